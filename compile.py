@@ -1,43 +1,206 @@
+import json
+import mmap
 import os
+import shutil
+import struct
+import time
 import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+# prefer a SIMD-accelerated DEFLATE implementation when one is installed;
+# the output is an ordinary DEFLATE stream either way.  ISA-L only knows
+# compression levels 0-3, so it gets its own default.
+try:
+    from zlib_ng import zlib_ng as zlib
+    COMPRESS_LEVEL = 6
+except ImportError:
+    try:
+        from isal import isal_zlib as zlib
+        COMPRESS_LEVEL = zlib.ISAL_DEFAULT_COMPRESSION
+    except ImportError:
+        import zlib
+        COMPRESS_LEVEL = 6
+
+
+def scan_files(source_dir, arc_prefix=""):
+    # os.walk() equivalent built directly on scandir: every DirEntry already
+    # knows whether it is a directory, so no extra stat() is made per file.
+    # yields (arcname, file_path) pairs with arcname under arc_prefix.
+    stack = [(source_dir, arc_prefix + "/" if arc_prefix else "")]
+    while stack:
+        path, arc_dir = stack.pop()
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append((entry.path, arc_dir + entry.name + "/"))
+                elif entry.is_file():
+                    yield arc_dir + entry.name, entry.path
 
 
 def zip_directory(source_dir, arc_prefix, zipf):
     # Walk a folder and add files to the archive under arc_prefix
-    for root, _, files in os.walk(source_dir):
-        for file in files:
-            file_path = os.path.join(root, file)
-            # compute archive name relative to the source directory, then prepend prefix
-            relpath = os.path.relpath(file_path, source_dir)
-            arcname = os.path.join(arc_prefix, relpath) if arc_prefix else relpath
-            zipf.write(file_path, arcname)
-
-
-def build_modpack(sources, output_filename):
-    # keep track of paths already added so we don't duplicate when a file
-    # exists in both the root and the minecraft/ subdirectory.
-    seen = set()
-    with zipfile.ZipFile(output_filename, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        for src, prefix in sources:
-            if os.path.isdir(src):
-                for root, _, files in os.walk(src):
-                    for file in files:
-                        file_path = os.path.join(root, file)
-                        relpath = os.path.relpath(file_path, src)
-                        arcname = os.path.join(prefix, relpath) if prefix else relpath
-                        if arcname in seen:
-                            continue
-                        seen.add(arcname)
-                        zipf.write(file_path, arcname)
-            elif os.path.isfile(src):
-                # single file (e.g. manifest) – use prefix as output name or the
-                # basename if no prefix supplied
-                arcname = prefix or os.path.basename(src)
-                if arcname not in seen:
-                    seen.add(arcname)
-                    zipf.write(src, arcname)
-            else:
-                print(f"warning: source path '{src}' does not exist, skipping")
+    for arcname, file_path in scan_files(source_dir, arc_prefix):
+        zipf.write(file_path, arcname)
+
+
+# formats that are already compressed (jars are zips) gain nothing from a
+# second DEFLATE pass, and very small files only grow from the overhead.
+STORED_EXTENSIONS = (".jar", ".zip", ".png", ".ogg")
+STORED_MAX_SIZE = 64
+# below this, setting up a mapping costs more than a plain read() copy
+MMAP_MIN_SIZE = 16 * 1024
+
+
+def _is_stored(file_path, size):
+    return file_path.lower().endswith(STORED_EXTENSIONS) or size < STORED_MAX_SIZE
+
+
+def _deflate(data):
+    return zlib.compress(data, COMPRESS_LEVEL, -15), zlib.crc32(data), len(data)
+
+
+def _compress(file_path):
+    # runs in a worker process: read and DEFLATE a single file, handing back
+    # the stream together with the CRC and size the zip headers need
+    with open(file_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < MMAP_MIN_SIZE:
+            return _deflate(f.read())
+        # larger files are mapped so the CRC and compressor read the page
+        # cache directly instead of an extra user-space copy
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return _deflate(data)
+
+
+def _write_compressed(zipf, zinfo, data):
+    # equivalent of ZipFile.write() for a member whose (stored or DEFLATEd)
+    # data was produced elsewhere; the CRC and sizes are already known, so the local
+    # header can be written once up front instead of patched afterwards.
+    zip64 = zinfo.file_size > zipfile.ZIP64_LIMIT or zinfo.compress_size > zipfile.ZIP64_LIMIT
+    if zip64 and not zipf._allowZip64:
+        raise zipfile.LargeZipFile("Filesize would require ZIP64 extensions")
+    zipf.fp.seek(zipf.start_dir)
+    zinfo.header_offset = zipf.fp.tell()
+    zipf._writecheck(zinfo)
+    zipf._didModify = True
+    zipf.fp.write(zinfo.FileHeader(zip64))
+    zipf.fp.write(data)
+    zipf.start_dir = zipf.fp.tell()
+    zipf.filelist.append(zinfo)
+    zipf.NameToInfo[zinfo.filename] = zinfo
+
+
+def _read_raw(zipf, zinfo):
+    # member data exactly as stored (still compressed) in an existing archive
+    zipf.fp.seek(zinfo.header_offset)
+    header = struct.unpack(zipfile.structFileHeader, zipf.fp.read(zipfile.sizeFileHeader))
+    zipf.fp.seek(header[zipfile._FH_FILENAME_LENGTH] + header[zipfile._FH_EXTRA_FIELD_LENGTH], 1)
+    return zipf.fp.read(zinfo.compress_size)
+
+
+def _load_previous(output_filename, manifest_filename):
+    # the previous pack and the manifest describing which source file and
+    # version each member came from; either missing means a full rebuild
+    if not manifest_filename or not os.path.exists(output_filename):
+        return None, {}
+    try:
+        with open(manifest_filename, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        return zipfile.ZipFile(output_filename), manifest
+    except (OSError, ValueError, zipfile.BadZipFile):
+        return None, {}
+
+
+def _zipinfo(arcname, st):
+    # what ZipInfo.from_file() builds, but from a stat result we already hold
+    # so the header, the manifest and the size checks all describe one stat
+    zinfo = zipfile.ZipInfo(arcname, time.localtime(st.st_mtime)[:6])
+    zinfo.external_attr = (st.st_mode & 0xFFFF) << 16
+    zinfo.file_size = st.st_size
+    return zinfo
+
+
+def collect_files(sources):
+    # map each archive path to the file that provides it.  the first source
+    # wins, so we don't duplicate when a file exists in both the root and the
+    # minecraft/ subdirectory; dict order keeps the archive order stable.
+    seen = {}
+    for src, prefix in sources:
+        if os.path.isdir(src):
+            for arcname, file_path in scan_files(src, prefix):
+                seen.setdefault(arcname, file_path)
+        elif os.path.isfile(src):
+            # single file (e.g. manifest) – use prefix as output name or the
+            # basename if no prefix supplied
+            seen.setdefault(prefix or os.path.basename(src), src)
+        else:
+            print(f"warning: source path '{src}' does not exist, skipping")
+    return list(seen.items())
+
+
+def build_modpack(sources, output_filename, manifest_filename=None):
+    entries = collect_files(sources)
+    stats = [os.stat(file_path) for _, file_path in entries]
+    manifest = {arcname: [file_path, st.st_mtime_ns, st.st_size]
+                for (arcname, file_path), st in zip(entries, stats)}
+    # ZIP64 records are only needed past 65535 members or ~4 GiB of data
+    # (with the same 5% headroom zipfile allows for compression overhead)
+    total_size = sum(st.st_size for st in stats)
+    allow_zip64 = (len(entries) >= zipfile.ZIP_FILECOUNT_LIMIT
+                   or total_size * 1.05 > zipfile.ZIP64_LIMIT)
+    # when a manifest from the last build is available, members whose source
+    # file is unchanged are copied over from the previous pack as-is instead
+    # of being read and compressed again
+    previous, old_manifest = _load_previous(output_filename, manifest_filename)
+    old_names = previous.NameToInfo if previous else {}
+    reused = {arcname for arcname, record in manifest.items()
+              if arcname in old_names and old_manifest.get(arcname) == record}
+    # stored members need no compression, so they are streamed straight into
+    # the archive here rather than shipped to and from a worker in full
+    stored = {arcname for (arcname, file_path), st in zip(entries, stats)
+              if arcname not in reused and _is_stored(file_path, st.st_size)}
+    changed = [file_path for arcname, file_path in entries
+               if arcname not in reused and arcname not in stored]
+    # build into a temporary file and swap it in at the end, so a failed or
+    # interrupted build never leaves a half-written pack behind
+    tmp_filename = output_filename + ".tmp"
+    try:
+        with zipfile.ZipFile(tmp_filename, 'w', zipfile.ZIP_DEFLATED, allowZip64=allow_zip64) as zipf:
+            # compression is the expensive part of the build, so it is spread
+            # across worker processes; only the archive layout (headers and the
+            # central directory) is written from this process.
+            with ProcessPoolExecutor() as ex:
+                results = ex.map(_compress, changed, chunksize=8)
+                for (arcname, file_path), st in zip(entries, stats):
+                    zinfo = _zipinfo(arcname, st)
+                    if arcname in stored:
+                        zinfo.compress_type = zipfile.ZIP_STORED
+                        with open(file_path, 'rb') as src, zipf.open(zinfo, 'w') as dest:
+                            shutil.copyfileobj(src, dest, 1024 * 1024)
+                        continue
+                    if arcname in reused:
+                        old = old_names[arcname]
+                        compress_type, data, crc, size = old.compress_type, _read_raw(previous, old), old.CRC, old.file_size
+                    else:
+                        compress_type = zipfile.ZIP_DEFLATED
+                        data, crc, size = next(results)
+                    zinfo.compress_type = compress_type
+                    zinfo.CRC = crc
+                    zinfo.file_size = size
+                    zinfo.compress_size = len(data)
+                    _write_compressed(zipf, zinfo, data)
+    except BaseException:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise
+    finally:
+        if previous:
+            previous.close()
+    os.replace(tmp_filename, output_filename)
+    if manifest_filename:
+        with open(manifest_filename, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+    return len(reused)
 
 
 if __name__ == "__main__":
@@ -57,7 +220,6 @@ if __name__ == "__main__":
     if not os.path.exists(inst_cfg):
         mc_version = None
         try:
-            import json
             with open(rel("mmc-pack.json"), "r", encoding="utf-8") as f:
                 data = json.load(f)
             for comp in data.get("components", []):
@@ -95,5 +257,7 @@ if __name__ == "__main__":
     if not os.path.exists(rel("build")):
         os.makedirs(rel("build"))
 
-    build_modpack(sources, output_zip)
+    reused = build_modpack(sources, output_zip, rel("build/modpack.manifest.json"))
+    if reused:
+        print(f"Reused {reused} unchanged files from the previous build.")
     print(f"Modpack zipped successfully: {output_zip}")
\ No newline at end of file
@@ -0,0 +1,50 @@
+import json, os, pathlib, sys, tempfile, unittest
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+import update
+
+
+class ImportPrismIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        root = pathlib.Path(self.tmp.name)
+        self.index_path = root / "metadata" / "mods"
+        self.index_path.mkdir(parents=True)
+        self.mods_path = root / "minecraft" / "mods"
+        self.mods_path.mkdir(parents=True)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_non_bmp_names_round_trip(self):
+        name = 'Fancy \U0001F600 "Mod" \\ \x7f'
+        fname = "fancy-\U0001F600.jar"
+        (self.mods_path / ".index").write_text(
+            json.dumps([{"fileName": fname, "name": name, "fileID": 1234567}]), encoding="utf-8")
+        update.import_prism_index(self.mods_path / ".index", self.index_path)
+        mods = update._parse(self.index_path.parent / "mods.toml")["mods"]
+        self.assertEqual(mods[fname]["name"], name)
+        self.assertEqual(mods[fname]["filename"], fname)
+        self.assertEqual(mods[fname]["update"]["curseforge"]["file-id"], 1234567)
+
+    def test_unrepresentable_index_files_are_kept_verbatim(self):
+        index_dir = self.mods_path / ".index"
+        index_dir.mkdir()
+        plain = 'name = "Plain"\nfilename = "plain.jar"\n'
+        dated = ('name = "Dated"\nfilename = "dated.jar"\nreleased = 1979-05-27T07:32:00Z\n'
+                 '[[deps]]\nid = "a"\n')
+        (index_dir / "plain.pw.toml").write_text(plain, encoding="utf-8")
+        (index_dir / "dated.pw.toml").write_text(dated, encoding="utf-8")
+        update.import_prism_index(index_dir, self.index_path)
+        mods = update._parse(self.index_path.parent / "mods.toml")["mods"]
+        self.assertEqual(mods["plain.pw"]["filename"], "plain.jar")
+        self.assertNotIn("dated.pw", mods)
+        self.assertEqual((self.index_path / "dated.pw.toml").read_text(encoding="utf-8"), dated)
+
+    def test_toml_value_rejects_unsupported_types(self):
+        with self.assertRaises(TypeError): update._toml_value([{"id": "a"}])
+        with self.assertRaises(TypeError): update._toml_value(object())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,4 +1,4 @@
-import os, pathlib, dataclasses, json, urllib.request, urllib.parse, sys
+import os, pathlib, dataclasses, json, urllib.request, urllib.parse, sys, concurrent.futures, shutil, hashlib, asyncio, io
 
 tomllib = None
 try: import tomllib as tomllib
@@ -13,47 +13,273 @@ except ImportError:
 if tomllib is None:
     raise RuntimeError("Cannot import tomllib or tomli")
 
+# urllib3 is optional; when present a single pool keeps connections to the
+# CDN hosts alive across jars instead of paying a TLS handshake per file.
+try: import urllib3
+except ImportError: urllib3 = None
+
+# aiohttp is optional too; with it every download runs on one event loop
+# instead of a thread each.
+try: import aiohttp
+except ImportError: aiohttp = None
+
+_WORKERS = 16
+_PER_HOST = 8
+_CHUNK = 1024 * 1024
+_CACHE_VERSION = 2
+# shared stand-in for missing tables; never mutated
+_EMPTY = {}
+_POOL = urllib3.PoolManager(maxsize=_WORKERS, retries=urllib3.Retry(3, backoff_factor=0.3)) if urllib3 else None
+
+_FORGECDN = "https://edge.forgecdn.net/files/"
+
 @dataclasses.dataclass
 class DownloadFile:
-    name: str; filename: str; project_id: str
-    @property
-    def url(self):
-        if self.project_id.startswith("http"): return self.project_id
+    name: str; filename: str; project_id: str; hash: str = ""; hash_format: str = "sha1"
+    url: str = dataclasses.field(init=False)
+    def __post_init__(self):
+        # built once here rather than on every access
+        if self.project_id.startswith("http"): self.url = self.project_id; return
         first, last = self.project_id[:-3], self.project_id[-3:]
-        return f"https://edge.forgecdn.net/files/{first}/{last}/{urllib.parse.quote(self.filename)}"
+        self.url = f"{_FORGECDN}{first}/{last}/{urllib.parse.quote(self.filename)}"
 
 def force_inclusion(file: str) -> bool: return file == "example-mod.jar"
 
-def import_prism_index(index_file: pathlib.Path, index_path: pathlib.Path):
+def _toml_value(v) -> str:
+    if isinstance(v, bool): return "true" if v else "false"
+    if isinstance(v, (int, float)): return repr(v)
+    if isinstance(v, str): return _toml_str(v)
+    if isinstance(v, list): return "[" + ", ".join(map(_toml_value, v)) + "]"
+    # dates, arrays of tables, ... would silently change meaning if written
+    # as strings, so refuse them instead
+    raise TypeError(f"cannot write {type(v).__name__} values to mods.toml")
+
+def _toml_str(s: str) -> str:
+    # a TOML basic string: JSON's escaping of quotes, backslashes and control
+    # characters matches, but everything else must stay raw, since TOML has no
+    # surrogate-pair escapes for characters outside the BMP.  DEL is the one
+    # control character JSON leaves alone.
+    return json.dumps(s, ensure_ascii=False).replace("\x7f", "\\u007f")
+
+def _toml_key(k: str) -> str:
+    bare = k.isascii() and k.replace("-", "").replace("_", "").isalnum()
+    return k if bare else _toml_str(k)
+
+def _write_tables(out, path: str, table: dict):
+    # a table's own keys have to come before any of its sub-tables
+    subs = [(k, v) for k, v in table.items() if isinstance(v, dict)]
+    if len(subs) < len(table) or not subs: out.write(f"\n[{path}]\n")
+    for k, v in table.items():
+        if not isinstance(v, dict): out.write(f"{_toml_key(k)} = {_toml_value(v)}\n")
+    for k, v in subs: _write_tables(out, f"{path}.{_toml_key(k)}", v)
+
+def import_prism_index(index_file: pathlib.Path, index_path: pathlib.Path, cache: dict = _EMPTY):
     if not index_file.exists(): return
+    # imported entries all go into a single metadata/mods.toml table rather
+    # than a file per mod, so main() parses one file instead of hundreds
+    combined = index_path.parent / "mods.toml"
+    candidates = {}
     if os.path.isdir(index_file):
         for child in index_file.iterdir():
             if child.suffix.lower() != ".toml": continue
-            dest = index_path / child.name
-            if dest.exists(): continue
-            dest.write_bytes(child.read_bytes())
-        return
+            if (index_path / child.name).exists(): continue
+            candidates[child.stem] = child
+    else:
+        try:
+            with open(index_file, "r", encoding="utf-8") as f: data = json.load(f)
+        except Exception as e:
+            print(f"failed to load prism index: {e}"); return
+        entries = data if isinstance(data, list) else data.get("mods", [])
+        for e in entries:
+            fname = e.get("filename") or e.get("fileName")
+            if not fname: continue
+            if (index_path / (fname + ".toml")).exists(): continue
+            mod = {"name": e.get("name", fname), "filename": fname}
+            cfid = (
+                e.get("curseforge_project_id")
+                or e.get("curseforgeProjectID")
+                or e.get("fileID")
+                or (e.get("update", {}) or {}).get("curseforge", {}).get("file-id")
+            )
+            if cfid: mod["update"] = {"curseforge": {"file-id": cfid}}
+            candidates[fname] = mod
+    # keys the metadata cache already holds for an unchanged mods.toml are
+    # known to be imported, so the usual run never has to parse mods.toml
+    if candidates and combined.exists():
+        st = os.stat(combined)
+        known = {k[len("mods.toml:"):] for k, v in cache.items() if k.startswith("mods.toml:") and _fresh(v, st)}
+        candidates = {k: v for k, v in candidates.items() if k not in known}
+    if not candidates: return
+    mods = _parse(combined).get("mods", {}) if combined.exists() else {}
+    added = 0
+    for key, mod in candidates.items():
+        if key in mods: continue
+        data = _parse(mod) if isinstance(mod, pathlib.Path) else mod
+        try: _write_tables(io.StringIO(), "mods.x", data)
+        except TypeError as e:
+            if isinstance(mod, pathlib.Path):
+                # keep what mods.toml can't hold verbatim as a per-mod file
+                (index_path / mod.name).write_bytes(mod.read_bytes())
+            else: print(f"warning: skipping prism index entry '{key}': {e}")
+            continue
+        mods[key] = data; added += 1
+    if not added: return
+    # render everything before touching mods.toml, so a failure can't
+    # leave it truncated
+    out = io.StringIO()
+    for key, mod in mods.items(): _write_tables(out, f"mods.{_toml_key(key)}", mod)
+    combined.write_text(out.getvalue(), encoding="utf-8")
+
+def _hash_matches(path: str, expected: str, fmt: str) -> bool:
+    # formats hashlib doesn't know (e.g. CurseForge's murmur2) can't be checked
+    if fmt not in hashlib.algorithms_available: return True
+    h = hashlib.new(fmt)
+    with open(path, "rb") as f:
+        while chunk := f.read(_CHUNK): h.update(chunk)
+    return h.hexdigest() == expected.lower()
+
+def _save(resp, status: int, part: pathlib.Path):
+    # 206 means the server honoured our Range header; anything else is the
+    # whole file again, so start the .part over
+    with open(part, "ab" if status == 206 else "wb") as output:
+        shutil.copyfileobj(resp, output, _CHUNK)
+
+def _resume(df: DownloadFile, mods_path: pathlib.Path):
+    # jars are written to a .part file first so an interrupted transfer is
+    # resumed with a Range request on the next run rather than restarted
+    part = mods_path / (df.filename + ".part")
+    return part, {"Range": f"bytes={part.stat().st_size}-"} if part.exists() else {}
+
+def _finish(df: DownloadFile, part: pathlib.Path, mods_path: pathlib.Path) -> bool:
+    if df.hash and not _hash_matches(part, df.hash, df.hash_format):
+        part.unlink(); print(f"failed to download {df.name}: {df.hash_format} mismatch"); return False
+    os.replace(part, mods_path / df.filename)
+    return True
+
+def _fetch(df: DownloadFile, mods_path: pathlib.Path) -> bool:
+    print(f"Downloading {df.name}...")
+    part, headers = _resume(df, mods_path)
+    try:
+        if _POOL is None:
+            with urllib.request.urlopen(urllib.request.Request(df.url, headers=headers)) as req:
+                _save(req, req.status, part)
+        else:
+            resp = _POOL.request("GET", df.url, headers=headers, preload_content=False)
+            try:
+                if resp.status >= 400:
+                    raise urllib.error.HTTPError(df.url, resp.status, resp.reason, resp.headers, None)
+                _save(resp, resp.status, part)
+            finally: resp.release_conn()
+        return _finish(df, part, mods_path)
+    except urllib.error.HTTPError as e:
+        if e.code == 416 and headers:
+            # the .part can't be resumed (e.g. it is already too long), start over
+            part.unlink(); return _fetch(df, mods_path)
+        print(f"failed to download {df.name}: HTTP {e.code} {e.reason}")
+    except Exception as e:
+        print(f"error downloading {df.name}: {e}")
+    return False
+
+async def _fetch_async(session, df: DownloadFile, mods_path: pathlib.Path) -> bool:
+    print(f"Downloading {df.name}...")
+    part, headers = _resume(df, mods_path)
+    loop = asyncio.get_running_loop()
     try:
-        with open(index_file, "r", encoding="utf-8") as f: data = json.load(f)
+        async with session.get(df.url, headers=headers) as resp:
+            if resp.status == 416 and headers:
+                part.unlink(); return await _fetch_async(session, df, mods_path)
+            if resp.status >= 400:
+                print(f"failed to download {df.name}: HTTP {resp.status} {resp.reason}"); return False
+            # file writes (and the hash check below) go to the default
+            # executor so the event loop keeps reading other responses
+            with open(part, "ab" if resp.status == 206 else "wb") as output:
+                async for chunk in resp.content.iter_chunked(_CHUNK):
+                    await loop.run_in_executor(None, output.write, chunk)
+        return await loop.run_in_executor(None, _finish, df, part, mods_path)
     except Exception as e:
-        print(f"failed to load prism index: {e}"); return
-    entries = data if isinstance(data, list) else data.get("mods", [])
-    for e in entries:
-        fname = e.get("filename") or e.get("fileName")
-        if not fname: continue
-        dest = index_path / (fname + ".toml")
-        if dest.exists(): continue
-        name = e.get("name", fname)
-        cfid = (
-            e.get("curseforge_project_id")
-            or e.get("curseforgeProjectID")
-            or e.get("fileID")
-            or (e.get("update", {}) or {}).get("curseforge", {}).get("file-id")
-        )
-        with open(dest, "w", encoding="utf-8") as out:
-            out.write(f'name = "{name}"\nfilename = "{fname}"\n')
-            if cfid:
-                out.write("\n[update.curseforge]\nfile-id = {cfid}\n")
+        # timeouts stringify to nothing, so fall back to the exception type
+        print(f"error downloading {df.name}: {str(e) or type(e).__name__}")
+    return False
+
+async def _download_all(downloaded: list, mods_path: pathlib.Path) -> list:
+    # one semaphore per host, sized like the connector's per-host limit, so a
+    # download only starts once it has a connection; no total timeout, since
+    # a large jar on a slow link can legitimately take a long time
+    sems = {}
+    connector = aiohttp.TCPConnector(limit=32, limit_per_host=_PER_HOST)
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=60)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        async def bounded(df):
+            sem = sems.setdefault(urllib.parse.urlsplit(df.url).netloc, asyncio.Semaphore(_PER_HOST))
+            async with sem: return await _fetch_async(session, df, mods_path)
+        return await asyncio.gather(*[bounded(df) for df in downloaded])
+
+def _parse(path: pathlib.Path) -> dict:
+    with open(path, "rb") as fd: return tomllib.load(fd)
+
+def _entry(data: dict) -> dict:
+    # only the fields main() needs survive into the cache
+    upd = data.get("update") or _EMPTY; download = data.get("download") or _EMPTY
+    return {
+        "name": data.get("name", "?"),
+        "filename": data.get("filename"),
+        "cfid": (upd.get("curseforge") or _EMPTY).get("file-id"),
+        "mr_url": (upd.get("modrinth") or _EMPTY).get("url"),
+        "hash": download.get("hash"),
+        "hash_format": download.get("hash-format", "sha1"),
+    }
+
+def _fresh(hit, st) -> bool:
+    return bool(hit) and hit.get("mtime") == st.st_mtime_ns and hit.get("size") == st.st_size
+
+def _stamp(entry: dict, jar: str):
+    # remember which on-disk jar was checked against the metadata hash
+    st = os.stat(jar); entry["verified"] = [st.st_mtime_ns, st.st_size]
+
+def _load_cache(cache_file: pathlib.Path) -> dict:
+    try:
+        with open(cache_file, "r", encoding="utf-8") as f: data = json.load(f)
+    except Exception: return {}
+    # entries written by an older layout are simply re-parsed
+    return data.get("files", {}) if data.get("version") == _CACHE_VERSION else {}
+
+def _save_cache(cache_file: pathlib.Path, cache: dict):
+    try:
+        with open(cache_file, "w", encoding="utf-8") as f: json.dump({"version": _CACHE_VERSION, "files": cache}, f)
+    except OSError as e: print(f"failed to save metadata cache: {e}")
+
+def _all_downloaded(index_path: pathlib.Path, mods_path: pathlib.Path, cache: dict) -> bool:
+    # answers "is there anything to do?" from the metadata cache alone: no
+    # metadata file changed, every jar it names is present (and verified if
+    # it has a hash) and there are no stray jars waiting to be deleted
+    if not cache or not mods_path.exists(): return False
+    tomls = 0
+    with os.scandir(index_path) as it:
+        for e in it:
+            if not e.name.endswith(".toml"): continue
+            if not _fresh(cache.get(e.name), e.stat()): return False
+            tomls += 1
+    combined = index_path.parent / "mods.toml"
+    combined_keys = [k for k in cache if k.startswith("mods.toml:")]
+    if combined.exists():
+        st = os.stat(combined)
+        if not combined_keys or not all(_fresh(cache[k], st) for k in combined_keys): return False
+    elif combined_keys: return False
+    # anything left over belongs to a metadata file that has been removed
+    if tomls + len(combined_keys) != len(cache): return False
+    with os.scandir(mods_path) as it: jars = {e.name: e for e in it if e.name.endswith(".jar")}
+    needed = set()
+    for entry in cache.values():
+        mn = entry["filename"]
+        # same precedence as main(): only the first entry for a jar counts
+        if not mn or mn in needed: continue
+        needed.add(mn)
+        jar = jars.get(mn)
+        if jar is None: return False
+        if entry["hash"]:
+            st = jar.stat()
+            if entry.get("verified") != [st.st_mtime_ns, st.st_size]: return False
+    return all(fn in needed or force_inclusion(fn) for fn in jars)
 
 def confirm(prompt: str) -> bool:
     if not sys.stdin.isatty(): print(prompt+" (auto-confirmed)"); return True
@@ -63,26 +289,71 @@ def main():
     instance = pathlib.Path(__file__).parent
     mods_path = instance / "minecraft" / "mods"
     index_path = instance / "metadata" / "mods"
-    import_prism_index(mods_path / ".index", index_path)
-    skipped=0; downloaded=[]; needed_files=set(); deleted_files=[]
-    for fn in os.listdir(index_path):
-        if not fn.endswith(".toml"): continue
-        with open(index_path / fn, "rb") as fd: data = tomllib.load(fd)
-        mn = data.get("filename")
-        if not mn: continue
-        needed_files.add(mn)
-        if (mods_path / mn).exists(): skipped+=1
+    # parsed metadata is cached against each file's mtime and size, so on a
+    # repeat run unchanged files cost a stat() rather than a full parse
+    cache_file = index_path.parent / ".cache.json"
+    old_cache = _load_cache(cache_file)
+    import_prism_index(mods_path / ".index", index_path, old_cache)
+    if _all_downloaded(index_path, mods_path, old_cache): print("All mods are already downloaded!"); return
+    skipped=0; downloaded=[]; needed_files=set(); deleted_files=[]; cache = {}; stale = []
+    with os.scandir(index_path) as it:
+        stats = sorted((e.name, e.stat()) for e in it if e.name.endswith(".toml"))
+    for fn, st in stats:
+        if not _fresh(old_cache.get(fn), st): stale.append((fn, st))
+    parsed = {}
+    if stale:
+        # every metadata file parses independently; tomllib holds the GIL, so
+        # really large packs are worth the cost of spinning up worker processes
+        pool = concurrent.futures.ProcessPoolExecutor if len(stale) > 200 else concurrent.futures.ThreadPoolExecutor
+        with pool() as ex: datas = list(ex.map(_parse, [index_path / fn for fn, _ in stale]))
+        for (fn, st), data in zip(stale, datas):
+            parsed[fn] = {"mtime": st.st_mtime_ns, "size": st.st_size, **_entry(data)}
+    # cache order decides which entry wins when two name the same jar: the
+    # per-mod files (sorted by name) always come before mods.toml, no matter
+    # which of them had to be re-parsed on this run
+    for fn, _ in stats: cache[fn] = parsed.get(fn) or old_cache[fn]
+    # entries from the combined mods.toml are cached under "mods.toml:<key>",
+    # all stamped with that one file's mtime and size
+    combined = index_path.parent / "mods.toml"
+    if combined.exists():
+        st = os.stat(combined)
+        hits = {k: v for k, v in old_cache.items() if k.startswith("mods.toml:")}
+        if hits and all(_fresh(hit, st) for hit in hits.values()): cache.update(hits)
         else:
-            cf_section = data.get("update", {}).get("curseforge", {})
-            cfid = cf_section.get("file-id")
-            mr_section = data.get("update", {}).get("modrinth", {})
-            mr_url = mr_section.get("url")
-            if cfid: downloaded.append(DownloadFile(data.get("name","?"),mn,str(cfid)))
-            elif mr_url: downloaded.append(DownloadFile(data.get("name","?"),mn,mr_url))
-            else: print(f"warning: no curseforge/modrinth info for '{mn}', skipping download")
+            for key, data in _parse(combined).get("mods", {}).items():
+                cache["mods.toml:" + key] = {"mtime": st.st_mtime_ns, "size": st.st_size, **_entry(data)}
+    def queue(entry):
+        mn, cfid, mr_url = entry["filename"], entry["cfid"], entry["mr_url"]
+        hashed = (entry["hash"] or "", entry["hash_format"])
+        if cfid: downloaded.append(DownloadFile(entry["name"],mn,str(cfid),*hashed))
+        elif mr_url: downloaded.append(DownloadFile(entry["name"],mn,mr_url,*hashed))
+        else: print(f"warning: no curseforge/modrinth info for '{mn}', skipping download")
+    unchecked = []; by_file = {}
+    # plain strings and local names keep pathlib and attribute lookups out of
+    # the per-mod loop
+    join = os.path.join; stat = os.stat; mods_dir = str(mods_path)
+    for entry in cache.values():
+        mn = entry["filename"]
+        if not mn or mn in by_file: continue
+        needed_files.add(mn); by_file[mn] = entry
+        try: st = stat(join(mods_dir, mn))
+        except FileNotFoundError: queue(entry); continue
+        if not entry["hash"] or entry.get("verified") == [st.st_mtime_ns, st.st_size]: skipped+=1
+        else: unchecked.append(entry)
+    if unchecked:
+        # an existing jar may still be corrupt or half-written, so compare it
+        # with the metadata hash.  hashlib releases the GIL while hashing, and
+        # the result is remembered until the jar's mtime or size changes.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=_WORKERS) as ex:
+            oks = list(ex.map(lambda e: _hash_matches(join(mods_dir, e["filename"]), e["hash"], e["hash_format"]), unchecked))
+        for entry, ok in zip(unchecked, oks):
+            if ok: skipped+=1; _stamp(entry, join(mods_dir, entry["filename"]))
+            else: print(f"'{entry['filename']}' does not match its {entry['hash_format']}, downloading it again"); queue(entry)
+    _save_cache(cache_file, cache)
     if mods_path.exists():
-        for fn in os.listdir(mods_path):
-            if not fn.endswith(".jar") or fn in needed_files: continue
+        with os.scandir(mods_path) as it: jars = [e.name for e in it if e.name.endswith(".jar")]
+        for fn in jars:
+            if fn in needed_files: continue
             if force_inclusion(fn): continue
             deleted_files.append(fn)
     if not deleted_files and not downloaded: print("All mods are already downloaded!"); return
@@ -91,17 +362,16 @@ def main():
         for f in deleted_files: os.unlink(mods_path / f)
     if downloaded and confirm(f"{len(downloaded)} files need to be downloaded. Continue? (Y/n) "):
         mods_path.mkdir(parents=True, exist_ok=True)
-        for df in downloaded:
-            print(f"Downloading {df.name}...")
-            try:
-                with urllib.request.urlopen(df.url) as req:
-                    with open(mods_path / df.filename, "wb") as output:
-                        while chunk := req.read(524288):
-                            output.write(chunk)
-            except urllib.error.HTTPError as e:
-                print(f"failed to download {df.name}: HTTP {e.code} {e.reason}")
-            except Exception as e:
-                print(f"error downloading {df.name}: {e}")
+        # downloads are network bound, so they are overlapped (on an event
+        # loop, or failing that a thread pool) instead of paying the
+        # connect/TLS/response latency of every jar serially
+        if aiohttp: results = asyncio.run(_download_all(downloaded, mods_path))
+        else:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(_WORKERS, len(downloaded))) as ex:
+                results = list(ex.map(lambda df: _fetch(df, mods_path), downloaded))
+        for df, ok in zip(downloaded, results):
+            if ok: _stamp(by_file[df.filename], join(mods_dir, df.filename))
+        _save_cache(cache_file, cache)
     print("All done!")
 
 if __name__ == "__main__":